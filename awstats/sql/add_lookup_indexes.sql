@@ -0,0 +1,101 @@
+-- One-off migration: unique lookup keys on website_url and file_tracking.
+-- Run check_lookup_indexes.sql first, then:
+--   mysql "$DB_NAME" < add_lookup_indexes.sql
+-- Each key is only created when the table has no unique key on exactly those
+-- columns, so running this against a table that already has one is a no-op
+-- apart from the duplicate merges, which then find nothing to merge.
+
+-- website_url: the key covers the full url column. A url(255) prefix key
+-- would make long URLs that share their first 255 characters collide.
+-- file_tracking: summary.py and urls.py track the same AWStats files, so the
+-- key includes script_name; (filename, server_id) alone would make them
+-- overwrite each other's rows.
+
+START TRANSACTION;
+
+-- 1. Merge duplicate website_url rows into the lowest id. Duplicates are
+--    grouped with the column's collation, the comparison the key will use.
+CREATE TEMPORARY TABLE website_url_dupes AS
+SELECT wu.id AS dupe_id, keep.keep_id
+FROM website_url wu
+INNER JOIN (
+    SELECT website_id, url, MIN(id) AS keep_id
+    FROM website_url
+    GROUP BY website_id, url
+    HAVING COUNT(*) > 1
+) keep ON keep.website_id = wu.website_id AND keep.url = wu.url AND wu.id <> keep.keep_id;
+
+INSERT INTO website_url_stats (website_url_id, server_id, year, month, hits, entry_count, exit_count)
+SELECT d.keep_id, ws.server_id, ws.year, ws.month, ws.hits, ws.entry_count, ws.exit_count
+FROM website_url_stats ws
+INNER JOIN website_url_dupes d ON ws.website_url_id = d.dupe_id
+ON DUPLICATE KEY UPDATE
+hits = website_url_stats.hits + VALUES(hits),
+entry_count = website_url_stats.entry_count + VALUES(entry_count),
+exit_count = website_url_stats.exit_count + VALUES(exit_count);
+
+DELETE ws FROM website_url_stats ws
+INNER JOIN website_url_dupes d ON ws.website_url_id = d.dupe_id;
+
+DELETE wu FROM website_url wu
+INNER JOIN website_url_dupes d ON wu.id = d.dupe_id;
+
+DROP TEMPORARY TABLE website_url_dupes;
+
+-- 2. Collapse duplicate file_tracking rows to the most recently processed one.
+CREATE TEMPORARY TABLE file_tracking_latest AS
+SELECT filename, server_id, script_name, MAX(processed_date) AS processed_date
+FROM file_tracking
+GROUP BY filename, server_id, script_name
+HAVING COUNT(*) > 1;
+
+CREATE TEMPORARY TABLE file_tracking_keep AS
+SELECT ft.filename, ft.server_id, ft.script_name, MAX(ft.last_modified) AS last_modified, l.processed_date
+FROM file_tracking ft
+INNER JOIN file_tracking_latest l
+    ON l.filename = ft.filename AND l.server_id = ft.server_id
+    AND l.script_name = ft.script_name AND l.processed_date = ft.processed_date
+GROUP BY ft.filename, ft.server_id, ft.script_name, l.processed_date;
+
+DELETE ft FROM file_tracking ft
+INNER JOIN file_tracking_latest l
+    ON l.filename = ft.filename AND l.server_id = ft.server_id AND l.script_name = ft.script_name;
+
+INSERT INTO file_tracking (filename, server_id, last_modified, processed_date, script_name)
+SELECT filename, server_id, last_modified, processed_date, script_name FROM file_tracking_keep;
+
+DROP TEMPORARY TABLE file_tracking_keep;
+DROP TEMPORARY TABLE file_tracking_latest;
+
+COMMIT;
+
+-- 3. Add each key only if no unique key on exactly those columns exists yet.
+SET @has_key = (
+    SELECT COUNT(*) FROM (
+        SELECT index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'website_url' AND non_unique = 0
+        GROUP BY index_name
+        HAVING GROUP_CONCAT(column_name ORDER BY seq_in_index) = 'website_id,url'
+    ) keys_found
+);
+SET @sql = IF(@has_key = 0,
+    'CREATE UNIQUE INDEX idx_wu_website_url ON website_url (website_id, url)',
+    'DO 0');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @has_key = (
+    SELECT COUNT(*) FROM (
+        SELECT index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'file_tracking' AND non_unique = 0
+        GROUP BY index_name
+        HAVING GROUP_CONCAT(column_name ORDER BY seq_in_index) = 'filename,server_id,script_name'
+    ) keys_found
+);
+SET @sql = IF(@has_key = 0,
+    'CREATE UNIQUE INDEX idx_ft_filename_server_script ON file_tracking (filename, server_id, script_name)',
+    'DO 0');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,29 @@
+-- Pre-check for add_lookup_indexes.sql. Read-only, run this first:
+--   mysql "$DB_NAME" < check_lookup_indexes.sql
+--
+-- Look for:
+-- * a unique key on exactly (website_id, url) on website_url, and whether url
+--   is a VARCHAR short enough for a full-column key (a TEXT column must be
+--   changed to VARCHAR first, within the 3072-byte index limit);
+-- * a unique key on exactly (filename, server_id, script_name) on
+--   file_tracking. update_file_tracking's ON DUPLICATE KEY UPDATE and the
+--   file_tracking cache in load_caches depend on it; without it every run
+--   adds another tracking row per file;
+-- * duplicate counts, which add_lookup_indexes.sql merges before adding keys.
+
+SHOW CREATE TABLE website_url;
+SHOW INDEX FROM website_url;
+SHOW CREATE TABLE file_tracking;
+SHOW INDEX FROM file_tracking;
+
+SELECT COUNT(*) AS duplicate_website_urls FROM (
+    SELECT website_id, url FROM website_url
+    GROUP BY website_id, url
+    HAVING COUNT(*) > 1
+) dupes;
+
+SELECT COUNT(*) AS duplicate_file_tracking_rows FROM (
+    SELECT filename, server_id, script_name FROM file_tracking
+    GROUP BY filename, server_id, script_name
+    HAVING COUNT(*) > 1
+) dupes;
@@ -2,6 +2,8 @@
 SCRIPT_NAME = 'summary'
 
 import os
+import re
+import mmap
 import argparse
 import mysql.connector
 from datetime import datetime
@@ -16,13 +18,17 @@ db_user = os.getenv('DB_USER')
 db_password = os.getenv('DB_PASSWORD')
 db_name = os.getenv('DB_NAME')
 
-# Database connection
+# AWStats data file names: awstatsMMYYYY.<website>.txt
+AWSTATS_FILE_RE = re.compile(r'^awstats(\d{2})(\d{4})\.(.+)\.txt$')
+
+# Database connection, using the C extension for the MySQL protocol
 def get_database_connection():
     return mysql.connector.connect(
         host=db_host,
         user=db_user,
         password=db_password,
-        database=db_name
+        database=db_name,
+        use_pure=False
     )
 
 def get_server_id(directory):
@@ -35,71 +41,74 @@ def get_server_id(directory):
     }
     return server_mapping.get(directory)
 
+# Caches loaded once per run so per-file checks don't hit the database
+websites_by_name = {}
+processed_files = {}
+
+def load_caches(cursor, script_name):
+    # Load websites and file tracking rows
+    cursor.execute("SELECT name, id FROM websites")
+    websites_by_name.update(cursor.fetchall())
+    cursor.execute("""
+        SELECT filename, server_id, last_modified FROM file_tracking
+        WHERE script_name = %s
+    """, (script_name,))
+    for filename, server_id, last_modified in cursor.fetchall():
+        processed_files[(filename, server_id)] = last_modified
+
 def get_website_id(cursor, website_name):
     # Check if website exists, else create it
-    cursor.execute("SELECT id FROM websites WHERE name = %s", (website_name,))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    else:
+    if website_name not in websites_by_name:
         cursor.execute("INSERT INTO websites (name) VALUES (%s)", (website_name,))
-        return cursor.lastrowid
-		
-def has_file_been_processed(cursor, filename, server_id, last_modified, force, script_name):
+        websites_by_name[website_name] = cursor.lastrowid
+    return websites_by_name[website_name]
+
+def has_file_been_processed(filename, server_id, last_modified, force):
     if force:
         return False  # Bypass the processing check if force is True
     # Check if file has been processed
-    cursor.execute("""
-        SELECT last_modified FROM file_tracking
-        WHERE filename = %s AND server_id = %s AND script_name = %s
-    """, (filename, server_id, script_name))
-    result = cursor.fetchone()
-    return result and result[0] == last_modified
+    return processed_files.get((filename, server_id)) == last_modified
 
-def update_file_tracking(cursor, filename, server_id, last_modified, script_name):
+def update_file_tracking(cursor, filename, server_id, last_modified, processed_date, script_name):
     # Update the file_tracking table
     cursor.execute("""
         INSERT INTO file_tracking (filename, server_id, last_modified, processed_date, script_name)
         VALUES (%s, %s, %s, %s, %s)
         ON DUPLICATE KEY UPDATE last_modified = VALUES(last_modified), processed_date = VALUES(processed_date)
-    """, (filename, server_id, last_modified, datetime.now().replace(microsecond=0), script_name))
+    """, (filename, server_id, last_modified, processed_date, script_name))
+    processed_files[(filename, server_id)] = last_modified
 
-def parse_begin_map(file):
+def read_section(mm, offset, end_marker):
+    # Return the bytes from offset up to end_marker in a memory-mapped file
+    end = mm.find(end_marker, offset)
+    if end == -1:
+        end = len(mm)
+    return mm[offset:end]
+
+def parse_begin_map(mm):
     # Parse the BEGIN_MAP section to get positions
     positions = {}
-    for line in file:
-        line = line.decode('utf-8').strip()
-        if line.startswith('BEGIN_MAP'):
-            continue
-        elif line.startswith('END_MAP'):
-            break
-        else:
-            parts = line.split()
-            if len(parts) == 2 and parts[0].startswith('POS_'):
-                positions[parts[0]] = int(parts[1])
+    for line in read_section(mm, 0, b'END_MAP').split(b'\n'):
+        parts = line.split()
+        if len(parts) == 2 and parts[0].startswith(b'POS_'):
+            positions[parts[0].decode('utf-8')] = int(parts[1])
     return positions
 
-def parse_pos_general(file, pos_general_offset):
+def parse_pos_general(mm, pos_general_offset):
     # Extract TotalUnique from POS_GENERAL
-    file.seek(pos_general_offset)
     total_unique = None
-    for line in file:
-        line = line.decode('utf-8').strip()
-        if line.startswith('END_GENERAL'):
-            break
-        elif line.startswith('TotalUnique'):
+    for line in read_section(mm, pos_general_offset, b'END_GENERAL').split(b'\n'):
+        line = line.strip()
+        if line.startswith(b'TotalUnique'):
             total_unique = int(line.split()[1])
     return total_unique
 
-def parse_pos_day(file, pos_day_offset):
+def parse_pos_day(mm, pos_day_offset):
     # Extract daily data from POS_DAY
-    file.seek(pos_day_offset)
     daily_data = []
-    for line in file:
-        line = line.decode('utf-8').strip()
-        if line.startswith('END_DAY'):
-            break
-        elif not line.startswith('#') and not line.startswith('BEGIN_DAY'):
+    for line in read_section(mm, pos_day_offset, b'END_DAY').split(b'\n'):
+        line = line.strip()
+        if not line.startswith(b'#') and not line.startswith(b'BEGIN_DAY'):
             parts = line.split()
             if len(parts) == 5:
                 date_str, pages, hits, bandwidth, visits = parts
@@ -117,17 +126,28 @@ def parse_pos_day(file, pos_day_offset):
                 })
     return daily_data
 
-def process_file(cursor, file_path, server_id, force):
+def process_file(cursor, daily_cursor, tracking_cursor, file_path, server_id, force, processed_date):
     filename = os.path.basename(file_path)
-    last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).replace(microsecond=0)
+    match = AWSTATS_FILE_RE.match(filename)
+    if not match:
+        print(f"Invalid file name format '{filename}'.")
+        return
+    # Stat the file once and skip it before any file I/O if it is unchanged
+    file_stat = os.stat(file_path)
+    last_modified = datetime.fromtimestamp(file_stat.st_mtime).replace(microsecond=0)
 
-    if has_file_been_processed(cursor, filename, server_id, last_modified, force, SCRIPT_NAME):
+    if has_file_been_processed(filename, server_id, last_modified, force):
         print(f"File {filename} has already been processed by {SCRIPT_NAME}.")
         return
 
-    with open(file_path, 'rb') as file:
+    if file_stat.st_size == 0:
+        print(f"File {filename} is empty.")
+        return
+
+    # Memory-map the file so each section is read straight from its offset without seeking
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
         # Parse BEGIN_MAP to get positions
-        positions = parse_begin_map(file)
+        positions = parse_begin_map(mm)
 
         # Check if necessary positions are available
         if 'POS_GENERAL' not in positions or 'POS_DAY' not in positions:
@@ -135,13 +155,13 @@ def process_file(cursor, file_path, server_id, force):
             return
 
         # Parse POS_GENERAL to get TotalUnique
-        total_unique = parse_pos_general(file, positions['POS_GENERAL'])
+        total_unique = parse_pos_general(mm, positions['POS_GENERAL'])
 
         # Parse POS_DAY to get daily data
-        daily_data = parse_pos_day(file, positions['POS_DAY'])
+        daily_data = parse_pos_day(mm, positions['POS_DAY'])
 
     # Extract website name from filename
-    website_name = '.'.join(filename.split('.')[1:-1])
+    website_name = match.group(3)
     website_id = get_website_id(cursor, website_name)
 
     # Insert monthly TotalUnique into summary table
@@ -155,9 +175,9 @@ def process_file(cursor, file_path, server_id, force):
             ON DUPLICATE KEY UPDATE unique_visitors = VALUES(unique_visitors)
         """, (website_id, server_id, year, month, day, total_unique))
 
-    # Insert daily data into summary table
+    # Insert daily data into summary table, reusing one server-side prepared statement
     for data in daily_data:
-        cursor.execute("""
+        daily_cursor.execute("""
             INSERT INTO summary (website_id, server_id, year, month, day, number_of_visits, pages, hits, bandwidth)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE number_of_visits = VALUES(number_of_visits),
@@ -166,7 +186,7 @@ def process_file(cursor, file_path, server_id, force):
               data['number_of_visits'], data['pages'], data['hits'], data['bandwidth']))
 
     # Update file_tracking
-    update_file_tracking(cursor, filename, server_id, last_modified, SCRIPT_NAME)
+    update_file_tracking(tracking_cursor, filename, server_id, last_modified, processed_date, SCRIPT_NAME)
     print(f"Processed file {filename}.")
 
 def main():
@@ -176,8 +196,15 @@ def main():
     parser.add_argument('--force', action='store_true', help='Force processing of the file(s)')
     args = parser.parse_args()
 
+    # Single timestamp recorded as processed_date for every file in this run
+    run_ts = datetime.now().replace(microsecond=0)
+
     connection = get_database_connection()
     cursor = connection.cursor()
+    # One prepared cursor per repeated statement, a prepared cursor re-prepares whenever its SQL changes
+    daily_cursor = connection.cursor(prepared=True)
+    tracking_cursor = connection.cursor(prepared=True)
+    load_caches(cursor, SCRIPT_NAME)
 
     directories = [
         '/var/lib/awstats',
@@ -202,17 +229,19 @@ def main():
             # Process only the specified file
             file_path = os.path.join(directory, args.file)
             if os.path.exists(file_path):
-                process_file(cursor, file_path, server_id, args.force)
+                process_file(cursor, daily_cursor, tracking_cursor, file_path, server_id, args.force, run_ts)
             else:
                 print(f"File '{args.file}' not found in directory '{directory}'.")
         else:
             # Process all files in the directory
             for filename in os.listdir(directory):
-                if filename.endswith('.txt') and 'awstats' in filename:
+                if AWSTATS_FILE_RE.match(filename):
                     file_path = os.path.join(directory, filename)
-                    process_file(cursor, file_path, server_id, args.force)
+                    process_file(cursor, daily_cursor, tracking_cursor, file_path, server_id, args.force, run_ts)
 
     connection.commit()
+    tracking_cursor.close()
+    daily_cursor.close()
     cursor.close()
     connection.close()
 
@@ -2,10 +2,19 @@
 SCRIPT_NAME = 'urls'
 
 import os
+import re
+import sys
+import mmap
 import argparse
+import tempfile
+import traceback
+import multiprocessing
 import mysql.connector
+from mysql.connector import errorcode
 import requests
+from array import array
 from datetime import datetime
+from itertools import islice
 from urllib.parse import unquote
 from dotenv import load_dotenv
 
@@ -18,15 +27,33 @@ db_user = os.getenv('DB_USER')
 db_password = os.getenv('DB_PASSWORD')
 db_name = os.getenv('DB_NAME')
 
-# Database connection
+# Database connection, using the C extension for the MySQL protocol
 def get_database_connection():
     return mysql.connector.connect(
         host=db_host,
         user=db_user,
         password=db_password,
-        database=db_name
+        database=db_name,
+        use_pure=False,
+        # Only allow LOAD DATA LOCAL to read the temporary files written by load_server_stats
+        allow_local_infile_in_path=tempfile.gettempdir()
     )
 
+# Maximum rows per multi-row statement, keeps statements under max_allowed_packet
+BATCH_SIZE = 5000
+
+# Maximum number of worker processes, each holds its own database connection
+MAX_WORKERS = 8
+
+# Attempts per file when MySQL reports a deadlock between workers
+DEADLOCK_RETRIES = 3
+
+# Files with more stats rows than this are loaded with LOAD DATA LOCAL INFILE
+LOAD_DATA_THRESHOLD = 20000
+
+# Cleared after the server rejects LOAD DATA LOCAL INFILE once
+load_data_enabled = True
+
 # Determine the path to the script directory
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -40,35 +67,38 @@ def get_server_id(directory):
     }
     return server_mapping.get(directory)
 
-# Get or create a website entry
-def get_website_id(cursor, website_name):
-    cursor.execute("SELECT id FROM websites WHERE name = %s", (website_name,))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    else:
+# Load websites and file tracking rows once so per-file checks don't hit the database
+def load_caches(cursor, script_name):
+    cursor.execute("SELECT name, id FROM websites")
+    websites_by_name.update(cursor.fetchall())
+    cursor.execute("""
+        SELECT filename, server_id, last_modified FROM file_tracking
+        WHERE script_name = %s
+    """, (script_name,))
+    for filename, server_id, last_modified in cursor.fetchall():
+        processed_files[(filename, server_id)] = last_modified
+
+# Look up a website entry
+def get_website_id(website_name):
+    website_id = websites_by_name.get(website_name)
+    if website_id is None:
         raise ValueError(f"Website '{website_name}' not found in database.")
+    return website_id
 
 # Check if the file has been processed
-def has_file_been_processed(cursor, filename, server_id, last_modified, force, script_name):
+def has_file_been_processed(filename, server_id, last_modified, force):
     if force:
         return False  # Bypass the processing check if force is True
-    # Check if file has been processed
-    cursor.execute("""
-        SELECT last_modified FROM file_tracking
-        WHERE filename = %s AND server_id = %s AND script_name = %s
-    """, (filename, server_id, script_name))
-    result = cursor.fetchone()
-    return result and result[0] == last_modified
+    return processed_files.get((filename, server_id)) == last_modified
 
 # Update file tracking table
-def update_file_tracking(cursor, filename, server_id, last_modified, script_name):
+def update_file_tracking(cursor, filename, server_id, last_modified, processed_date, script_name):
     # Update the file_tracking table
     cursor.execute("""
         INSERT INTO file_tracking (filename, server_id, last_modified, processed_date, script_name)
         VALUES (%s, %s, %s, %s, %s)
         ON DUPLICATE KEY UPDATE last_modified = VALUES(last_modified), processed_date = VALUES(processed_date)
-    """, (filename, server_id, last_modified, datetime.now().replace(microsecond=0), script_name))
+    """, (filename, server_id, last_modified, processed_date, script_name))
 
 # Fetch valid content pages from MediaWiki API
 def get_valid_content_pages(api_url):
@@ -101,62 +131,81 @@ def get_valid_content_pages(api_url):
             break
     return valid_pages
 
-# Parse the BEGIN_MAP section to get positions
-def parse_begin_map(file):
+# Return the bytes from offset up to end_marker in a memory-mapped file
+def read_section(mm, offset, end_marker):
+    end = mm.find(end_marker, offset)
+    if end == -1:
+        end = len(mm)
+    return mm[offset:end]
+
+# Parse the BEGIN_MAP section of a memory-mapped file to get positions
+def parse_begin_map(mm):
     positions = {}
-    for line in file:
-        line = line.decode('utf-8').strip()
-        if line.startswith('BEGIN_MAP'):
-            continue
-        elif line.startswith('END_MAP'):
-            break
-        else:
-            parts = line.split()
-            if len(parts) == 2 and parts[0].startswith('POS_'):
-                positions[parts[0]] = int(parts[1])
+    for line in read_section(mm, 0, b'END_MAP').split(b'\n'):
+        parts = line.split()
+        if len(parts) == 2 and parts[0].startswith(b'POS_'):
+            positions[parts[0].decode('utf-8')] = int(parts[1])
     return positions
 
-# Parse POS_SIDER section
-def parse_pos_sider(file, pos_sider_offset):
-    file.seek(pos_sider_offset)
-    url_data = []
-    for line in file:
-        line = line.decode('utf-8').strip()
-        if line.startswith('END_SIDER'):
+# Matches AWStats data file names: awstatsMMYYYY.<website>.txt
+AWSTATS_FILE_RE = re.compile(r'^awstats(\d{2})(\d{4})\.(.+)\.txt$')
+
+# Matches a POS_SIDER data row: URL, Pages, Bandwidth, Entry, Exit (bandwidth is not captured)
+SIDER_ROW_RE = re.compile(rb'(?m)^[ \t]*([^\s#]\S*)[ \t]+(\d+)[ \t]+\d+[ \t]+(\d+)[ \t]+(\d+)[ \t\r]*$')
+
+# Parse POS_SIDER section of a memory-mapped file into parallel urls, pages, entry and exit columns
+def parse_pos_sider(mm, pos_sider_offset):
+    urls = []
+    pages_col = array('q')
+    entry_col = array('q')
+    exit_col = array('q')
+    for match in SIDER_ROW_RE.finditer(read_section(mm, pos_sider_offset, b'END_SIDER')):
+        raw_url, pages, entry, exit_ = match.groups()
+        url = raw_url.decode('utf-8')
+
+        # Remove leading slash if present
+        if url.startswith('/'):
+            url = url[1:]
+
+        # Remove 'wiki/' prefix if present
+        if url.startswith('wiki/'):
+            url = url[len('wiki/'):]
+
+        # Decode URL-encoded characters, most wiki titles have none
+        if b'%' in raw_url:
+            url = unquote(url)
+
+        # Replace underscores with spaces
+        url = url.replace('_', ' ')
+
+        urls.append(url)
+        pages_col.append(int(pages))
+        entry_col.append(int(entry))
+        exit_col.append(int(exit_))
+    return urls, pages_col, entry_col, exit_col
+
+# Split rows into lists of at most size items
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
             break
-        elif not line.startswith('#') and not line.startswith('BEGIN_SIDER'):
-            parts = line.split()
-            if len(parts) == 5:  # URL, Pages, Bandwidth, Entry, Exit
-                raw_url = parts[0]
-
-                # Now proceed with URL processing
-                url = raw_url
-
-                # Remove leading slash if present
-                if url.startswith('/'):
-                    url = url[1:]
-
-                # Remove 'wiki/' prefix if present
-                if url.startswith('wiki/'):
-                    url = url[len('wiki/'):]
-
-                # Decode URL-encoded characters
-                url = unquote(url)
-
-                # Replace underscores with spaces
-                url = url.replace('_', ' ')
-
-                pages, bandwidth, entry, exit_ = map(int, parts[1:])
-                url_data.append({
-                    'url': url,
-                    'pages': pages,
-                    'bandwidth': bandwidth,
-                    'entry': entry,
-                    'exit': exit_
-                })
-    return url_data
-
-# Get or create a website_url entry
+        yield batch
+
+# Look up website_url ids for the given URLs
+def fetch_website_url_ids(cursor, website_id, urls):
+    url_to_id = {}
+    for batch in batched(urls, BATCH_SIZE):
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(f"""
+            SELECT url, id FROM website_url
+            WHERE website_id = %s AND url IN ({placeholders})
+        """, [website_id, *batch])
+        url_to_id.update(cursor.fetchall())
+    return url_to_id
+
+# Get or create a single website_url entry, matching the url column's collation
 def get_or_create_website_url_id(cursor, website_id, url):
     cursor.execute("SELECT id FROM website_url WHERE website_id = %s AND url = %s", (website_id, url))
     result = cursor.fetchone()
@@ -165,40 +214,147 @@ def get_or_create_website_url_id(cursor, website_id, url):
     cursor.execute("INSERT INTO website_url (website_id, url) VALUES (%s, %s)", (website_id, url))
     return cursor.lastrowid
 
-# Update server stats
-def update_server_stats(cursor, website_url_id, server_id, year, month, data):
+# Get or create website_url entries for a set of URLs, returns the website's cached url -> id dict
+def get_or_create_website_url_ids(cursor, website_id, urls):
+    if website_id not in website_url_ids:
+        cursor.execute("SELECT url, id FROM website_url WHERE website_id = %s", (website_id,))
+        website_url_ids[website_id] = dict(cursor.fetchall())
+    url_to_id = website_url_ids[website_id]
+    missing = [url for url in dict.fromkeys(urls) if url not in url_to_id]
+    if missing:
+        for batch in batched(missing, BATCH_SIZE):
+            try:
+                cursor.executemany("INSERT INTO website_url (website_id, url) VALUES (%s, %s)",
+                                   [(website_id, url) for url in batch])
+            except mysql.connector.IntegrityError:
+                # A URL in the batch matches an existing row under the column's collation
+                for url in batch:
+                    url_to_id[url] = get_or_create_website_url_id(cursor, website_id, url)
+        url_to_id.update(fetch_website_url_ids(cursor, website_id, [url for url in missing if url not in url_to_id]))
+        # The stored url can differ from the Python string, look those up one at a time
+        for url in missing:
+            if url not in url_to_id:
+                url_to_id[url] = get_or_create_website_url_id(cursor, website_id, url)
+    return url_to_id
+
+# Delete website_url entries of a website that have no stats, dropping only those ids from the cache
+def delete_unused_website_urls(cursor, website_id):
     cursor.execute("""
-        INSERT INTO website_url_stats (website_url_id, server_id, year, month, hits, entry_count, exit_count)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        hits = hits + VALUES(hits),
-        entry_count = entry_count + VALUES(entry_count),
-        exit_count = exit_count + VALUES(exit_count)
-    """, (website_url_id, server_id, year, month, data['pages'], data['entry'], data['exit']))
+        SELECT wu.id FROM website_url wu
+        LEFT JOIN website_url_stats ws ON wu.id = ws.website_url_id
+        WHERE wu.website_id = %s AND ws.website_url_id IS NULL
+    """, (website_id,))
+    unused_ids = {row[0] for row in cursor.fetchall()}
+    for batch in batched(unused_ids, BATCH_SIZE):
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(f"DELETE FROM website_url WHERE id IN ({placeholders})", batch)
+    url_to_id = website_url_ids.get(website_id)
+    if url_to_id and unused_ids:
+        website_url_ids[website_id] = {url: id_ for url, id_ in url_to_id.items() if id_ not in unused_ids}
+
+# Bulk load server stats through a temporary table, used for very large files.
+# Returns False when the server rejects LOAD DATA LOCAL so the caller can fall back.
+def load_server_stats(cursor, rows):
+    global load_data_enabled
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False) as tsv:
+        for row in rows:
+            tsv.write('\t'.join(map(str, row)) + '\n')
+    try:
+        try:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_url_stats")
+            cursor.execute("""
+                CREATE TEMPORARY TABLE tmp_url_stats (
+                    website_url_id INT, server_id INT, stat_year INT, stat_month INT,
+                    pages INT, entry INT, exit_c INT
+                ) ENGINE=MEMORY
+            """)
+            cursor.execute("""
+                LOAD DATA LOCAL INFILE %s INTO TABLE tmp_url_stats
+                FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+            """, (tsv.name,))
+        except mysql.connector.Error as e:
+            # e.g. local_infile is OFF on the server or CREATE TEMPORARY TABLES is not granted
+            print(f"LOAD DATA LOCAL INFILE unavailable, using batched inserts instead: {e}")
+            load_data_enabled = False
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_url_stats")
+            return False
+        cursor.execute("""
+            INSERT INTO website_url_stats (website_url_id, server_id, year, month, hits, entry_count, exit_count)
+            SELECT website_url_id, server_id, stat_year, stat_month, pages, entry, exit_c FROM tmp_url_stats
+            ON DUPLICATE KEY UPDATE
+            hits = hits + VALUES(hits),
+            entry_count = entry_count + VALUES(entry_count),
+            exit_count = exit_count + VALUES(exit_count)
+        """)
+        cursor.execute("DROP TEMPORARY TABLE tmp_url_stats")
+    finally:
+        os.remove(tsv.name)
+    return True
+
+# Update server stats in batches; the driver rewrites each batch into one multi-row INSERT
+def update_server_stats(cursor, rows):
+    if load_data_enabled and len(rows) > LOAD_DATA_THRESHOLD and load_server_stats(cursor, rows):
+        return
+    for batch in batched(rows, BATCH_SIZE):
+        cursor.executemany("""
+            INSERT INTO website_url_stats (website_url_id, server_id, year, month, hits, entry_count, exit_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            hits = hits + VALUES(hits),
+            entry_count = entry_count + VALUES(entry_count),
+            exit_count = exit_count + VALUES(exit_count)
+        """, batch)
+
+# Global caches of websites and file tracking rows, loaded once per run
+websites_by_name = {}
+processed_files = {}
+
+# Global cache of website_url ids per website, kept across files within a run
+website_url_ids = {}
 
 # Global caches to prevent multiple fetches and insertions per domain
 valid_pages_cache = {}
 valid_urls_inserted = set()
 
+# Database connection for this process, opened in main and lazily in each worker
+connection = None
+
 # Global variables
-excluded_websites = ['fr.bahai.works', 'bahaiconcordance.org']
+excluded_websites = frozenset(['fr.bahai.works', 'bahaiconcordance.org'])
 
 # Process a single AWStats file
-def process_file(cursor, file_path, server_id, force):
+def process_file(cursor, prepared_cursor, file_path, server_id, force, processed_date):
     global valid_pages_cache
     global valid_urls_inserted
 
     filename = os.path.basename(file_path)
-    last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).replace(microsecond=0)
+    match = AWSTATS_FILE_RE.match(filename)
+    if not match:
+        print(f"Invalid file name format '{filename}'.")
+        return
+    month, year, website_name = int(match.group(1)), int(match.group(2)), match.group(3)
+
+    # Check if the website is in the exclusion list before reading the file
+    if website_name in excluded_websites:
+        print(f"Skipping excluded website '{website_name}'.")
+        return
+
+    # Stat the file once and skip it before any file I/O if it is unchanged
+    file_stat = os.stat(file_path)
+    last_modified = datetime.fromtimestamp(file_stat.st_mtime).replace(microsecond=0)
 
     # Check if the file has already been processed
-    if has_file_been_processed(cursor, filename, server_id, last_modified, force, SCRIPT_NAME):
+    if has_file_been_processed(filename, server_id, last_modified, force):
         print(f"File {filename} has already been processed by {SCRIPT_NAME}.")
         return
 
-    with open(file_path, 'rb') as file:
+    if file_stat.st_size == 0:
+        print(f"File {filename} is empty.")
+        return
+
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
         # Parse BEGIN_MAP to get section positions
-        positions = parse_begin_map(file)
+        positions = parse_begin_map(mm)
 
         # Verify the required POS_SIDER section is available
         if 'POS_SIDER' not in positions:
@@ -206,84 +362,114 @@ def process_file(cursor, file_path, server_id, force):
             return
 
         # Parse the POS_SIDER section
-        sider_data = parse_pos_sider(file, positions['POS_SIDER'])
+        sider_urls, sider_pages, sider_entry, sider_exit = parse_pos_sider(mm, positions['POS_SIDER'])
 
-    # Extract website name from filename
-    website_name = '.'.join(filename.split('.')[1:-1])
+    website_id = get_website_id(website_name)
 
-    # Check if the website is in the exclusion list
-    if website_name in excluded_websites:
-        print(f"Skipping excluded website '{website_name}'.")
-        return
-        
-    website_id = get_website_id(cursor, website_name)
-
-    # Use cached valid pages if available
-    if website_name in valid_pages_cache:
-        valid_pages = valid_pages_cache[website_name]
-        print(f"Using cached valid pages for {website_name}.")
-    else:
-        # Construct the API URL
-        api_url = f'https://{website_name}/api.php'
-
-        # Fetch valid content pages from MediaWiki API
-        print(f"Fetching valid content pages from MediaWiki API at {api_url}...")
-        try:
-            valid_pages = get_valid_content_pages(api_url)
-            # Cache the valid pages
-            valid_pages_cache[website_name] = valid_pages
-        except Exception as e:
-            print(f"Error fetching valid pages for {website_name}: {e}")
-            return
-        print(f"Retrieved {len(valid_pages)} valid pages for {website_name}.")
-
-    # Insert valid URLs into website_url table only once per website
-    if website_name not in valid_urls_inserted:
-        print(f"Inserting valid URLs into database for {website_name}...")
-        for url in valid_pages:
-            # Check if the URL already exists
-            cursor.execute("SELECT id FROM website_url WHERE website_id = %s AND url = %s", (website_id, url))
-            result = cursor.fetchone()
-            if not result:
-                cursor.execute("INSERT INTO website_url (website_id, url) VALUES (%s, %s)", (website_id, url))
-        # Commit the insertion of valid URLs
-        connection.commit()
-        valid_urls_inserted.add(website_name)
-    else:
-        print(f"Valid URLs for {website_name} already inserted during this execution.")
+    # Run all writes for this file in a single transaction
+    cursor.execute("START TRANSACTION")
+    try:
+        # Use cached valid pages if available
+        if website_name in valid_pages_cache:
+            valid_pages = valid_pages_cache[website_name]
+            print(f"Using cached valid pages for {website_name}.")
+        else:
+            # Construct the API URL
+            api_url = f'https://{website_name}/api.php'
+
+            # Fetch valid content pages from MediaWiki API
+            print(f"Fetching valid content pages from MediaWiki API at {api_url}...")
+            try:
+                valid_pages = get_valid_content_pages(api_url)
+                # Cache the valid pages
+                valid_pages_cache[website_name] = valid_pages
+            except Exception as e:
+                print(f"Error fetching valid pages for {website_name}: {e}")
+                connection.rollback()
+                return
+            print(f"Retrieved {len(valid_pages)} valid pages for {website_name}.")
 
-    # Determine year and month from filename
-    year = int(filename[9:13])
-    month = int(filename[7:9])
+        # Insert valid URLs into website_url table only once per website
+        if website_name not in valid_urls_inserted:
+            print(f"Inserting valid URLs into database for {website_name}...")
+            get_or_create_website_url_ids(cursor, website_id, valid_pages)
+            valid_urls_inserted.add(website_name)
+        else:
+            print(f"Valid URLs for {website_name} already inserted during this execution.")
 
-    # If force is True, delete existing data related to the website, server, year, and month
-    if force:
-        print(f"Force option detected. Deleting existing stats for {website_name} for {year}-{month:02d}...")
-        # Delete stats for the specified website, server, year, and month
-        cursor.execute("""
-            DELETE ws FROM website_url_stats ws
-            INNER JOIN website_url wu ON ws.website_url_id = wu.id
-            WHERE wu.website_id = %s AND ws.server_id = %s AND ws.year = %s AND ws.month = %s
-        """, (website_id, server_id, year, month))
-        # Delete unused URLs for the website if they have no stats
-        cursor.execute("""
-            DELETE wu FROM website_url wu
-            LEFT JOIN website_url_stats ws ON wu.id = ws.website_url_id
-            WHERE wu.website_id = %s AND ws.website_url_id IS NULL
-        """, (website_id,))
+        # If force is True, delete existing data related to the website, server, year, and month
+        if force:
+            print(f"Force option detected. Deleting existing stats for {website_name} for {year}-{month:02d}...")
+            # Delete stats for the specified website, server, year, and month
+            cursor.execute("""
+                DELETE ws FROM website_url_stats ws
+                INNER JOIN website_url wu ON ws.website_url_id = wu.id
+                WHERE wu.website_id = %s AND ws.server_id = %s AND ws.year = %s AND ws.month = %s
+            """, (website_id, server_id, year, month))
+            # Delete unused URLs for the website if they have no stats
+            delete_unused_website_urls(cursor, website_id)
 
-    # Insert or update stats for each URL in POS_SIDER
-    for data in sider_data:
-        url = data['url']
-        if url not in valid_pages:
-            continue  # Skip URLs not in the list of valid pages
+        # Resolve website_url ids for all valid URLs in POS_SIDER at once, skipping other URLs
+        url_to_id = get_or_create_website_url_ids(cursor, website_id, [url for url in sider_urls if url in valid_pages])
 
-        website_url_id = get_or_create_website_url_id(cursor, website_id, url)
-        update_server_stats(cursor, website_url_id, server_id, year, month, data)
+        # Collect stats for each URL in POS_SIDER
+        stats_rows = [
+            (url_to_id[url], server_id, year, month, pages, entry, exit_)
+            for url, pages, entry, exit_ in zip(sider_urls, sider_pages, sider_entry, sider_exit)
+            if url in valid_pages
+        ]
 
-    # Update the file tracking to mark it as processed
-    update_file_tracking(cursor, filename, server_id, last_modified, SCRIPT_NAME)
-    print(f"Processed file {filename}.")
+        # Insert or update all stats for the file in batches
+        update_server_stats(cursor, stats_rows)
+
+        # Update the file tracking to mark it as processed
+        update_file_tracking(prepared_cursor, filename, server_id, last_modified, processed_date, SCRIPT_NAME)
+        connection.commit()
+        processed_files[(filename, server_id)] = last_modified
+        print(f"Processed file {filename}.")
+    except Exception:
+        # Discard the partial file and any cached state written in this transaction
+        connection.rollback()
+        website_url_ids.pop(website_id, None)
+        valid_urls_inserted.discard(website_name)
+        raise
+
+# Process all files of one website in a worker process, returns False if the website failed
+def process_website_files(website_tasks):
+    global connection
+    website_name, tasks = website_tasks
+    try:
+        # Connect lazily so a refused connection is reported instead of respawning the worker
+        if connection is None:
+            connection = get_database_connection()
+            cursor = connection.cursor()
+            load_caches(cursor, SCRIPT_NAME)
+            cursor.close()
+        cursor = connection.cursor()
+        # Prepared cursor for the file tracking update; bulk statements stay on the
+        # regular cursor so executemany is still rewritten into multi-row INSERTs
+        prepared_cursor = connection.cursor(prepared=True)
+        try:
+            for file_path, server_id, force, processed_date in tasks:
+                for attempt in range(1, DEADLOCK_RETRIES + 1):
+                    try:
+                        process_file(cursor, prepared_cursor, file_path, server_id, force, processed_date)
+                        break
+                    except mysql.connector.Error as e:
+                        # process_file has rolled back, so a deadlocked file can be retried as a whole
+                        if e.errno != errorcode.ER_LOCK_DEADLOCK or attempt == DEADLOCK_RETRIES:
+                            raise
+                        print(f"Deadlock processing {file_path}, retrying ({attempt}/{DEADLOCK_RETRIES})...")
+        finally:
+            prepared_cursor.close()
+            cursor.close()
+    except Exception:
+        print(f"Error processing website '{website_name}':\n{traceback.format_exc()}")
+        # Reconnect for the next website if this connection is broken
+        if connection is not None and not connection.is_connected():
+            connection = None
+        return False
+    return True
 
 # Main function
 def main():
@@ -294,9 +480,13 @@ def main():
     parser.add_argument('--website', type=str, help='Specify the website name')
     args = parser.parse_args()
 
+    # Single timestamp recorded as processed_date for every file in this run
+    run_ts = datetime.now().replace(microsecond=0)
+
     global connection
     connection = get_database_connection()
     cursor = connection.cursor()
+    load_caches(cursor, SCRIPT_NAME)
 
     directories = [
         '/var/lib/awstats',
@@ -313,9 +503,9 @@ def main():
 
     # If force is True, delete existing data related to the website/server/file
     if args.force:
-        if args.website:
-            # Get the website_id
-            website_id = get_website_id(cursor, args.website)
+        # Look up the --website entry once from the cached websites
+        website_id = get_website_id(args.website) if args.website else None
+        if website_id is not None:
             # Delete stats for the specified website
             cursor.execute("""
                 DELETE ws FROM website_url_stats ws
@@ -347,26 +537,14 @@ def main():
             """)
         if args.file:
             # Extract website_name, year, and month from args.file
-            filename = args.file
-            filename_without_extension = filename[:-4]  # Remove '.txt'
-            parts = filename_without_extension.split('.')
-            if len(parts) < 2:
-                print(f"Invalid file name format '{args.file}'. Cannot extract website name.")
+            match = AWSTATS_FILE_RE.match(args.file)
+            if not match:
+                print(f"Invalid file name format '{args.file}'. Cannot extract website name, year and month.")
                 return
-            # Extract website name
-            website_name = '.'.join(parts[1:])
-            # Extract year and month from file name (assuming format 'awstatsMMYYYY')
-            import re
-            match = re.match(r'awstats(\d{2})(\d{4})', filename_without_extension)
-            if match:
-                month_str, year_str = match.groups()
-                month = int(month_str)
-                year = int(year_str)
-            else:
-                print(f"Invalid file name format '{args.file}'. Cannot extract year and month.")
-                return
-            # Get website_id
-            website_id = get_website_id(cursor, website_name)
+            month, year, website_name = int(match.group(1)), int(match.group(2)), match.group(3)
+        if args.file and website_name != args.website:
+            # Only needed when --file belongs to a website not already cleared above
+            website_id = get_website_id(website_name)
             # Delete stats for the specified website, year, and month
             cursor.execute("""
                 DELETE ws FROM website_url_stats ws
@@ -384,6 +562,14 @@ def main():
             cursor.execute("DELETE FROM website_url_stats")
             cursor.execute("DELETE FROM website_url")
 
+    # Commit the force deletes before workers start writing
+    connection.commit()
+    cursor.close()
+    connection.close()
+    connection = None
+
+    # Group files by website, each website is processed sequentially by one worker
+    tasks_by_website = {}
     for directory in directories:
         server_id = get_server_id(directory)
         if server_id is None:
@@ -393,23 +579,33 @@ def main():
         if args.file:
             file_path = os.path.join(directory, args.file)
             if os.path.exists(file_path):
-                process_file(cursor, file_path, server_id, args.force)
+                match = AWSTATS_FILE_RE.match(args.file)
+                website_part = match.group(3) if match else args.file
+                tasks_by_website.setdefault(website_part, []).append((file_path, server_id, args.force, run_ts))
             else:
                 print(f"File '{args.file}' not found in directory '{directory}'.")
         else:
             for filename in os.listdir(directory):
-                if filename.endswith('.txt') and 'awstats' in filename:
-                    if args.website:
-                        filename_without_extension = filename[:-4]
-                        website_part = '.'.join(filename.split('.')[1:-1])
-                        if website_part != args.website:
-                            continue
-                    file_path = os.path.join(directory, filename)
-                    process_file(cursor, file_path, server_id, args.force)
+                match = AWSTATS_FILE_RE.match(filename)
+                if not match:
+                    continue
+                website_part = match.group(3)
+                if args.website and website_part != args.website:
+                    continue
+                file_path = os.path.join(directory, filename)
+                tasks_by_website.setdefault(website_part, []).append((file_path, server_id, args.force, run_ts))
+
+    if not tasks_by_website:
+        return
 
-    connection.commit()
-    cursor.close()
-    connection.close()
+    processes = min(MAX_WORKERS, os.cpu_count() or 1, len(tasks_by_website))
+    with multiprocessing.Pool(processes=processes) as pool:
+        results = pool.map(process_website_files, tasks_by_website.items())
+
+    failed = [website for website, ok in zip(tasks_by_website, results) if not ok]
+    if failed:
+        print(f"Failed to process {len(failed)} website(s): {', '.join(failed)}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()